@@ -1,10 +1,19 @@
+import hmac
 import os
+from dotenv import load_dotenv
 from fastapi import Header, HTTPException
 
-def require_admin(x_admin_key: str | None = Header(default=None)) -> None:
-    expected = os.getenv("ADMIN_KEY", "")
-    if not expected:
-        raise HTTPException(status_code=500, detail="ADMIN_KEY not set")
+load_dotenv()
+
+# Read once at import so a missing key fails the deploy, not each admin request
+ADMIN_KEY = os.getenv("ADMIN_KEY", "")
+
+if not ADMIN_KEY:
+    raise RuntimeError("ADMIN_KEY is not set. Add it in .env (local) or Render -> Environment.")
 
-    if not x_admin_key or x_admin_key != expected:
+_ADMIN_KEY_BYTES = ADMIN_KEY.encode()
+
+def require_admin(x_admin_key: str | None = Header(default=None)) -> None:
+    # constant-time compare so the key can't be guessed byte by byte
+    if not x_admin_key or not hmac.compare_digest(x_admin_key.encode(), _ADMIN_KEY_BYTES):
         raise HTTPException(status_code=401, detail="Invalid admin key")
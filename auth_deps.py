@@ -1,4 +1,9 @@
-from fastapi import Depends, HTTPException
+import hashlib
+import threading
+import time
+
+from cachetools import TTLCache, cached
+from fastapi import Depends, HTTPException, Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import jwt, JWTError
 from sqlalchemy.orm import Session
@@ -9,19 +14,59 @@ from auth_utils import JWT_SECRET, JWT_ALG
 
 security = HTTPBearer()
 
+_JWT_ALGORITHMS = [JWT_ALG]
+
+# Decoded JWT payloads, keyed by the token's SHA-256 (never the raw token)
+_token_cache = TTLCache(maxsize=4096, ttl=30)
+
+@cached(
+    _token_cache,
+    key=lambda token: hashlib.sha256(token.encode()).digest(),
+    lock=threading.Lock(),
+)
+def _decode_token(token: str) -> dict:
+    return jwt.decode(token, JWT_SECRET, algorithms=_JWT_ALGORITHMS)
+
+# Detached User rows, keyed by user id. Call invalidate_user() after changing a user.
+_user_cache = TTLCache(maxsize=5000, ttl=60)
+_user_cache_lock = threading.Lock()
+
+def invalidate_user(user_id: int) -> None:
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+
 def get_current_user(
+    request: Request,
     creds: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db),
 ) -> User:
+    # already resolved for this request (e.g. by another dependency)
+    user = getattr(request.state, "current_user", None)
+    if user is not None:
+        return user
+
     token = creds.credentials
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
+        payload = _decode_token(token)
+        # cached payloads skip jose's exp check, so re-check it here
+        if payload.get("exp", 0) < time.time():
+            raise ValueError("token expired")
         user_id = int(payload.get("sub"))
     except (JWTError, TypeError, ValueError):
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
+    with _user_cache_lock:
+        user = _user_cache.get(user_id)
+
+    if user is None:
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+
+        # detach so the cached row can be shared across sessions/requests
+        db.expunge(user)
+        with _user_cache_lock:
+            _user_cache[user_id] = user
 
+    request.state.current_user = user
     return user
@@ -1,24 +1,83 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from jose import jwt
-from passlib.context import CryptContext
 
 # For MVP only. Later move these to .env
 JWT_SECRET = "change_me_super_long"
 JWT_ALG = "HS256"
 ACCESS_TOKEN_MINUTES = 60 * 24 * 7  # 7 days
 
+# Cost of new hashes; verify always uses the rounds embedded in the stored hash,
+# and login rehashes any stored hash whose rounds differ (see password_needs_rehash)
+_pbkdf2_rounds_env = os.getenv("PBKDF2_ROUNDS", "29000").strip()
+
+if not _pbkdf2_rounds_env.isdigit() or int(_pbkdf2_rounds_env) < 1:
+    raise RuntimeError("PBKDF2_ROUNDS must be a positive integer.")
+
+PBKDF2_ROUNDS = int(_pbkdf2_rounds_env)
+
 # ✅ Use PBKDF2 instead of bcrypt (more stable on Windows)
-pwd_context = CryptContext(
-    schemes=["pbkdf2_sha256"],
-    deprecated="auto"
-)
+# pbkdf2_sha256 hashes are computed with hashlib (OpenSSL) directly, in passlib's
+# "$pbkdf2-sha256$rounds$salt$checksum" format so old and new hashes stay interchangeable.
+_PBKDF2_PREFIX = "$pbkdf2-sha256$"
+_PBKDF2_SALT_BYTES = 16
+
+def _ab64_encode(data: bytes) -> str:
+    # passlib's "adapted base64": no padding, "." instead of "+"
+    return base64.b64encode(data).decode("ascii").rstrip("=").replace("+", ".")
+
+def _ab64_decode(data: str) -> bytes:
+    data = data.replace(".", "+")
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+def _password_bytes(password: str) -> bytes:
+    # simple safety: strip accidental spaces; encode once for the hash calls
+    return password.strip().encode("utf-8")
 
 def hash_password(password: str) -> str:
-    # simple safety: strip accidental spaces
-    return pwd_context.hash(password.strip())
+    salt = os.urandom(_PBKDF2_SALT_BYTES)
+    checksum = hashlib.pbkdf2_hmac("sha256", _password_bytes(password), salt, PBKDF2_ROUNDS)
+    return f"{_PBKDF2_PREFIX}{PBKDF2_ROUNDS}${_ab64_encode(salt)}${_ab64_encode(checksum)}"
 
 def verify_password(password: str, password_hash: str) -> bool:
-    return pwd_context.verify(password.strip(), password_hash)
+    # unrecognised or malformed hashes just fail verification
+    if not password_hash.startswith(_PBKDF2_PREFIX):
+        return False
+
+    secret = _password_bytes(password)
+    try:
+        rounds, salt, checksum = password_hash[len(_PBKDF2_PREFIX):].split("$")
+        expected = _ab64_decode(checksum)
+        actual = hashlib.pbkdf2_hmac("sha256", secret, _ab64_decode(salt), int(rounds))
+    except ValueError:
+        return False
+
+    return hmac.compare_digest(actual, expected)
+
+def password_needs_rehash(password_hash: str) -> bool:
+    if not password_hash.startswith(_PBKDF2_PREFIX):
+        return True
+    rounds = password_hash[len(_PBKDF2_PREFIX):].split("$", 1)[0]
+    return not rounds.isdigit() or int(rounds) != PBKDF2_ROUNDS
+
+# Dedicated, bounded pool for PBKDF2 so a burst of logins can't starve the shared threadpool
+_hash_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", "4")),
+    thread_name_prefix="pwhash",
+)
+
+async def hash_password_async(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, hash_password, password)
+
+async def verify_password_async(password: str, password_hash: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, verify_password, password, password_hash)
 
 def create_access_token(user_id: int) -> str:
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_MINUTES)
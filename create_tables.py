@@ -1,5 +1,6 @@
-from db import Base, engine
-import models  # this loads the User model
+from deps import engine
+from models import Base, ensure_indexes  # this loads the models
 
 Base.metadata.create_all(bind=engine)
+ensure_indexes(engine)
 print("✅ Tables created!")
@@ -1,6 +1,7 @@
 import os
+import time
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
 # Load .env (local dev)
@@ -11,11 +12,28 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL is not set. Add it in .env (local) or Render -> Environment.")
 
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+
 engine = create_engine(
     DATABASE_URL,
     pool_pre_ping=True,
+    pool_size=10,
+    max_overflow=20,
+    pool_recycle=1800,
 )
 
+# ---------------- SLOW QUERY LOG ----------------
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info["query_start_time"].pop()) * 1000
+    if elapsed_ms >= SLOW_QUERY_MS:
+        print(f"🐢 Slow query ({elapsed_ms:.0f} ms):", statement)
+
 SessionLocal = sessionmaker(
     autocommit=False,
     autoflush=False,
@@ -1,32 +1,49 @@
 from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, EmailStr, field_validator
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 import os
-import uuid
+import shutil
 import hashlib
 import secrets
 from datetime import datetime, timedelta, timezone
+from pathlib import PurePosixPath
 import requests
+from requests.adapters import HTTPAdapter
 
 from deps import get_db, engine
-from models import Base, User, Document, PasswordResetToken
-from auth_deps import get_current_user
+from models import Base, User, Document, PasswordResetToken, ensure_indexes
+from auth_deps import get_current_user, invalidate_user
 from admin_auth import require_admin
-from auth_utils import hash_password, verify_password, create_access_token
+from auth_utils import (
+    hash_password_async,
+    verify_password_async,
+    password_needs_rehash,
+    create_access_token,
+)
 
-app = FastAPI(title="Document Explainer API")
+app = FastAPI(title="Document Explainer API", default_response_class=ORJSONResponse)
 
 # ---------------- STARTUP ----------------
 
+# Set AUTO_CREATE_TABLES=0 (e.g. multi-worker prod) and run create_tables.py once instead
+AUTO_CREATE_TABLES = os.getenv("AUTO_CREATE_TABLES", "1") == "1"
+
 @app.on_event("startup")
 def on_startup():
+    if not AUTO_CREATE_TABLES:
+        return
+
     try:
         Base.metadata.create_all(bind=engine)
+        ensure_indexes(engine)
         print("✅ DB tables ensured")
-    except OperationalError as e:
-        print("⚠️ DB not reachable on startup (local dev). App will still run.")
+    except SQLAlchemyError as e:
+        print("⚠️ DB not ready on startup (unreachable or schema upgrade failed). App will still run.")
         print(e)
 
 # ---------------- CORS (LOCKED DOWN) ----------------
@@ -70,10 +87,26 @@ FRONTEND_URL = os.getenv("FRONTEND_URL", "https://document-explainer-blond.verce
 RESEND_API_KEY = os.getenv("RESEND_API_KEY", "")
 FROM_EMAIL = os.getenv("FROM_EMAIL", "Document Explainer <onboarding@resend.dev>")
 
+STORAGE_DIR = "storage"
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+FREE_DOCS_LIMIT = 3
+
+os.makedirs(STORAGE_DIR, exist_ok=True)
+
+# Keep-alive session so reset emails reuse the TLS connection to Resend
+_resend_session = requests.Session()
+_resend_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
 def utcnow():
     return datetime.now(timezone.utc)
 
 def hash_token(token: str) -> str:
+    # 32-byte digest keeps the stored hex at 64 chars, same as the old SHA-256
+    return hashlib.blake2b(token.encode(), digest_size=32).hexdigest()
+
+def legacy_hash_token(token: str) -> str:
+    # SHA-256 hashes from before the BLAKE2b switch; safe to drop once those
+    # tokens have expired (30 minutes after deploy)
     return hashlib.sha256(token.encode()).hexdigest()
 
 def send_reset_email(to_email: str, reset_link: str):
@@ -103,7 +136,7 @@ def send_reset_email(to_email: str, reset_link: str):
     """
 
     try:
-        r = requests.post(
+        r = _resend_session.post(
             "https://api.resend.com/emails",
             headers={
                 "Authorization": f"Bearer {RESEND_API_KEY}",
@@ -132,16 +165,23 @@ def health():
 
 # ---------------- AUTH MODELS ----------------
 
-class RegisterBody(BaseModel):
+class EmailBody(BaseModel):
     email: EmailStr
+
+    # normalized once here so endpoints can use body.email as-is
+    @field_validator("email")
+    @classmethod
+    def normalize_email(cls, v: str) -> str:
+        return v.lower().strip()
+
+class RegisterBody(EmailBody):
     password: str
 
-class LoginBody(BaseModel):
-    email: EmailStr
+class LoginBody(EmailBody):
     password: str
 
-class ForgotPasswordBody(BaseModel):
-    email: EmailStr
+class ForgotPasswordBody(EmailBody):
+    pass
 
 class ResetPasswordBody(BaseModel):
     token: str
@@ -149,43 +189,59 @@ class ResetPasswordBody(BaseModel):
 
 # ---------------- AUTH ----------------
 
+# Auth endpoints are async so PBKDF2 can run on the dedicated hashing pool;
+# their DB calls go through run_in_threadpool to stay off the event loop.
+
 @app.post("/auth/register")
-def register(body: RegisterBody, db: Session = Depends(get_db)):
-    email = body.email.lower().strip()
+async def register(body: RegisterBody, db: Session = Depends(get_db)):
+    email = body.email
 
-    if db.query(User).filter(User.email == email).first():
+    # cheap pre-check; the unique constraint on email is the real guard
+    exists_q = db.query(db.query(User).filter(User.email == email).exists())
+    if await run_in_threadpool(exists_q.scalar):
         raise HTTPException(status_code=400, detail="Email already registered")
 
     user = User(
         email=email,
-        password_hash=hash_password(body.password),
+        password_hash=await hash_password_async(body.password),
         free_docs_used=0,
         is_paid=False,
     )
 
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    try:
+        await run_in_threadpool(db.commit)
+    except IntegrityError:
+        await run_in_threadpool(db.rollback)
+        raise HTTPException(status_code=400, detail="Email already registered")
+    await run_in_threadpool(db.refresh, user)
 
     token = create_access_token(user.id)
     return {"user_id": user.id, "token": token}
 
 @app.post("/auth/login")
-def login(body: LoginBody, db: Session = Depends(get_db)):
-    email = body.email.lower().strip()
-    user = db.query(User).filter(User.email == email).first()
+async def login(body: LoginBody, db: Session = Depends(get_db)):
+    email = body.email
+    user = await run_in_threadpool(db.query(User).filter(User.email == email).first)
 
-    if not user or not verify_password(body.password, user.password_hash):
+    if not user or not await verify_password_async(body.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    token = create_access_token(user.id)
-    return {
+    # read before any commit below expires the row (a reload would run on the event loop)
+    response = {
         "user_id": user.id,
-        "token": token,
+        "token": create_access_token(user.id),
         "free_docs_used": user.free_docs_used,
         "is_paid": user.is_paid,
     }
 
+    # bring the stored hash to the current PBKDF2_ROUNDS so changing it takes effect
+    if password_needs_rehash(user.password_hash):
+        user.password_hash = await hash_password_async(body.password)
+        await run_in_threadpool(db.commit)
+
+    return response
+
 # ---------------- FORGOT / RESET PASSWORD ----------------
 
 @app.post("/auth/forgot-password")
@@ -194,7 +250,7 @@ def forgot_password(
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
 ):
-    email = body.email.lower().strip()
+    email = body.email
     user = db.query(User).filter(User.email == email).first()
 
     # Always return ok to prevent email enumeration
@@ -219,29 +275,35 @@ def forgot_password(
     return {"ok": True}
 
 @app.post("/auth/reset-password")
-def reset_password(body: ResetPasswordBody, db: Session = Depends(get_db)):
+async def reset_password(body: ResetPasswordBody, db: Session = Depends(get_db)):
     if len(body.new_password) < 8:
         raise HTTPException(status_code=400, detail="Password too short")
 
-    token_hash_value = hash_token(body.token)
+    token_hashes = [hash_token(body.token), legacy_hash_token(body.token)]
 
-    reset = (
+    reset = await run_in_threadpool(
         db.query(PasswordResetToken)
-        .filter(PasswordResetToken.token_hash == token_hash_value)
-        .first()
+        .filter(
+            PasswordResetToken.token_hash.in_(token_hashes),
+            PasswordResetToken.used_at.is_(None),
+        )
+        .first
     )
 
     if not reset or reset.used_at or reset.expires_at < utcnow():
         raise HTTPException(status_code=400, detail="Invalid or expired token")
 
-    user = db.query(User).filter(User.id == reset.user_id).first()
+    user = await run_in_threadpool(db.query(User).filter(User.id == reset.user_id).first)
     if not user:
         raise HTTPException(status_code=400, detail="Invalid token")
 
-    user.password_hash = hash_password(body.new_password)
+    # read before commit: the commit expires user, and reloading it would query on the event loop
+    user_id = user.id
+    user.password_hash = await hash_password_async(body.new_password)
     reset.used_at = utcnow()
 
-    db.commit()
+    await run_in_threadpool(db.commit)
+    invalidate_user(user_id)
     return {"ok": True}
 
 # ---------------- USER ----------------
@@ -257,23 +319,92 @@ def me(current_user: User = Depends(get_current_user)):
 
 # ---------------- DOCUMENTS ----------------
 
+def _write_upload(src, tmp_path: str) -> None:
+    # written under a temp name; _save_document publishes it after the DB commit.
+    # 0o666 lets the umask apply, so files get the same mode open(..., "wb") gave.
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(src, f, length=UPLOAD_CHUNK_SIZE)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def _free_limit_reached(is_paid: bool, free_docs_used: int) -> bool:
+    return not is_paid and free_docs_used >= FREE_DOCS_LIMIT
+
+def _discard_document(db: Session, doc: Document, counted: bool) -> None:
+    # undo a committed upload whose file never made it to storage
+    doc_id, stored_path = doc.id, doc.stored_path
+    try:
+        db.delete(doc)
+        if counted:
+            db.query(User).filter(User.id == doc.user_id).update(
+                {User.free_docs_used: User.free_docs_used - 1},
+                synchronize_session=False,
+            )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print("🚨 Document row points at a missing file, fix by hand:", doc_id, stored_path, e)
+
+def _save_document(db: Session, user_id: int, doc: Document, tmp_path: str) -> None:
+    try:
+        # current_user comes from a per-worker cache, so re-check the quota
+        # against the locked row; concurrent uploads serialize here
+        is_paid, free_docs_used = (
+            db.query(User.is_paid, User.free_docs_used)
+            .filter(User.id == user_id)
+            .with_for_update()
+            .one()
+        )
+        if _free_limit_reached(is_paid, free_docs_used):
+            raise HTTPException(status_code=402, detail="Free limit reached")
+
+        db.add(doc)
+        if not is_paid:
+            db.query(User).filter(User.id == user_id).update(
+                {User.free_docs_used: User.free_docs_used + 1},
+                synchronize_session=False,
+            )
+
+        db.commit()
+    except BaseException:
+        # row was rejected: don't leave an orphaned file behind
+        db.rollback()
+        os.unlink(tmp_path)
+        raise
+
+    try:
+        os.replace(tmp_path, doc.stored_path)
+    except OSError as e:
+        print("⚠️ Could not publish upload, removing document row:", doc.stored_path, e)
+        _discard_document(db, doc, counted=not is_paid)
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise HTTPException(status_code=500, detail="Could not store file")
+
+    db.refresh(doc)
+
 @app.post("/documents/upload")
-def upload_document(
+async def upload_document(
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    if not current_user.is_paid and current_user.free_docs_used >= 3:
+    # fresh read (not the cached user) so the 402 short-circuits before any
+    # disk work; _save_document re-checks it under a row lock
+    quota_q = db.query(User.is_paid, User.free_docs_used).filter(User.id == current_user.id)
+    if _free_limit_reached(*await run_in_threadpool(quota_q.one)):
         raise HTTPException(status_code=402, detail="Free limit reached")
 
-    os.makedirs("storage", exist_ok=True)
+    ext = PurePosixPath(file.filename).suffix if file.filename else ""
+    stored_filename = f"{secrets.token_hex(16)}{ext}"
+    stored_path = os.path.join(STORAGE_DIR, stored_filename)
 
-    ext = os.path.splitext(file.filename)[1] if file.filename else ""
-    stored_filename = f"{uuid.uuid4().hex}{ext}"
-    stored_path = os.path.join("storage", stored_filename)
-
-    with open(stored_path, "wb") as f:
-        f.write(file.file.read())
+    # one threadpool hop for the whole copy instead of one per chunk
+    tmp_path = f"{stored_path}.part"
+    await run_in_threadpool(_write_upload, file.file, tmp_path)
 
     doc = Document(
         user_id=current_user.id,
@@ -283,13 +414,8 @@ def upload_document(
         status="uploaded",
     )
 
-    db.add(doc)
-
-    if not current_user.is_paid:
-        current_user.free_docs_used += 1
-
-    db.commit()
-    db.refresh(doc)
+    await run_in_threadpool(_save_document, db, current_user.id, doc, tmp_path)
+    invalidate_user(current_user.id)
 
     return {"document_id": doc.id}
 
@@ -298,8 +424,15 @@ def list_documents(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
+    # only the listed columns: plain row tuples, no ORM instance per document
     docs = (
-        db.query(Document)
+        db.query(
+            Document.id,
+            Document.original_filename,
+            Document.stored_filename,
+            Document.created_at,
+            Document.status,
+        )
         .filter(Document.user_id == current_user.id)
         .order_by(Document.id.desc())
         .all()
@@ -368,4 +501,30 @@ def admin_list_users(
     db: Session = Depends(get_db),
     _admin=Depends(require_admin),
 ):
-    return db.query(User).all()
+    # one grouped query instead of touching user.documents per row
+    rows = (
+        db.query(
+            User.id,
+            User.email,
+            User.is_paid,
+            User.free_docs_used,
+            User.created_at,
+            func.count(Document.id).label("document_count"),
+        )
+        .outerjoin(Document, Document.user_id == User.id)
+        .group_by(User.id)
+        .order_by(User.id)
+        .all()
+    )
+
+    return [
+        {
+            "id": u.id,
+            "email": u.email,
+            "is_paid": u.is_paid,
+            "free_docs_used": u.free_docs_used,
+            "created_at": u.created_at,
+            "document_count": u.document_count,
+        }
+        for u in rows
+    ]
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Index, text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from db import Base
@@ -37,6 +37,11 @@ class Document(Base):
 
     owner = relationship("User", back_populates="documents")
 
+    # serves list_documents: filter by user_id, order by id desc
+    __table_args__ = (
+        Index("ix_documents_user_id_id", user_id, id.desc()),
+    )
+
 
 # 🔐 PASSWORD RESET TOKENS
 class PasswordResetToken(Base):
@@ -45,8 +50,31 @@ class PasswordResetToken(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
 
-    token_hash = Column(String, nullable=False, index=True)
+    token_hash = Column(String, nullable=False)
     expires_at = Column(DateTime(timezone=True), nullable=False)
     used_at = Column(DateTime(timezone=True), nullable=True)
 
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    # only unused tokens are ever looked up, so keep used ones out of the index
+    __table_args__ = (
+        Index("ix_prt_token_hash", token_hash, postgresql_where=used_at.is_(None)),
+    )
+
+
+# create_all only builds indexes for tables it creates, so databases that predate
+# the __table_args__ indexes above get them here. Safe to run repeatedly.
+LEGACY_INDEXES = ["ix_password_reset_tokens_token_hash"]
+
+# arbitrary key so concurrent workers don't race each other's CREATE INDEX
+_INDEX_UPGRADE_LOCK = 7315402
+
+
+def ensure_indexes(bind) -> None:
+    with bind.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _INDEX_UPGRADE_LOCK})
+        for table in (Document.__table__, PasswordResetToken.__table__):
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        for name in LEGACY_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))